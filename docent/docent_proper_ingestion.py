@@ -5,13 +5,34 @@ Proper Docent ingestion script using correct data models.
 
 import json
 import os
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from typing import Dict, List, Any, Iterable, Iterator
 from docent import Docent
 from docent.data_models.agent_run import AgentRun
 from docent.data_models.transcript import Transcript
 from docent.data_models.chat.message import UserMessage, AssistantMessage
 from docent.data_models.metadata import BaseAgentRunMetadata, BaseMetadata
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BATCH_SIZE = 64
+UPLOAD_WORKERS = 4
+
+ROLE_MESSAGE_CLASSES = {
+    'user': UserMessage,
+    'assistant': AssistantMessage
+}
+
+def _chunks(iterable: Iterable[Any], n: int) -> Iterator[List[Any]]:
+    """Split an iterable into lists of at most n items"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
+
 class ProperDocentIngestor:
     def __init__(self, api_key: str = None):
         """Initialize Docent client with proper data models"""
@@ -23,21 +44,22 @@ class ProperDocentIngestor:
         self.client = Docent(api_key=self.api_key)
         print("Docent client initialized successfully")
     
-    def create_agent_runs_from_data(self, data_file: str = "docent_prepared_data.json") -> List[AgentRun]:
-        """Create proper AgentRun objects from our data"""
-        with open(data_file, 'r') as f:
-            runs_data = json.load(f)
-        
-        agent_runs = []
-        
-        for i, run_data in enumerate(runs_data):
-            # Create messages using proper message classes
-            messages = []
-            for msg in run_data['messages']:
-                if msg['role'] == 'user':
-                    messages.append(UserMessage(content=msg['content']))
-                elif msg['role'] == 'assistant':
-                    messages.append(AssistantMessage(content=msg['content']))
+    def iter_runs_data(self, data_file: str) -> Iterator[Dict[str, Any]]:
+        """Read prepared runs one NDJSON line at a time"""
+        with open(data_file, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line) if orjson else json.loads(line)
+    
+    def create_agent_runs_from_data(self, data_file: str = "docent_prepared_data.jsonl") -> Iterator[AgentRun]:
+        """Create proper AgentRun objects from our data, one run at a time"""
+        for i, run_data in enumerate(self.iter_runs_data(data_file)):
+            # Create messages using proper message classes (other roles are skipped)
+            messages = [
+                ROLE_MESSAGE_CLASSES[msg['role']](content=msg['content'])
+                for msg in run_data['messages']
+                if msg['role'] in ROLE_MESSAGE_CLASSES
+            ]
             
             # Create transcript
             transcript = Transcript(
@@ -64,30 +86,52 @@ class ProperDocentIngestor:
                 metadata=agent_run_metadata
             )
             
-            agent_runs.append(agent_run)
-        
-        return agent_runs
+            yield agent_run
+    
+    def _upload_batch(self, collection_id: str, batch: List[AgentRun]) -> int:
+        """Upload one batch of agent runs and return its size"""
+        self.client.add_agent_runs(
+            collection_id=collection_id,
+            agent_runs=batch
+        )
+        return len(batch)
     
     def ingest_to_collection(self, collection_id: str):
-        """Ingest data to the specified collection"""
+        """Ingest data to the specified collection in fixed-size batches"""
         print(f"Creating agent runs from data...")
         agent_runs = self.create_agent_runs_from_data()
         
-        print(f"Ingesting {len(agent_runs)} agent runs to collection {collection_id}...")
+        print(f"Ingesting agent runs to collection {collection_id} in batches of {BATCH_SIZE}...")
         
-        try:
-            result = self.client.add_agent_runs(
-                collection_id=collection_id,
-                agent_runs=agent_runs
-            )
-            
-            print(f"✅ Successfully ingested {len(agent_runs)} agent runs!")
-            print(f"🔍 View your data at: https://docent-alpha.transluce.org/dashboard/{collection_id}")
-            return True, len(agent_runs)
-            
-        except Exception as e:
-            print(f"❌ Failed to ingest agent runs: {e}")
-            return False, 0
+        ingested = 0
+        failed = 0
+        
+        def collect(futures):
+            nonlocal ingested, failed
+            for future in futures:
+                try:
+                    ingested += future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"❌ Failed to ingest batch: {e}")
+        
+        # Keep at most UPLOAD_WORKERS batches in flight so the generator is not drained into memory
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            pending = set()
+            for batch in _chunks(agent_runs, BATCH_SIZE):
+                if len(pending) >= UPLOAD_WORKERS:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(self._upload_batch, collection_id, batch))
+            collect(pending)
+        
+        if failed:
+            print(f"❌ {failed} batches failed; ingested {ingested} agent runs")
+            return False, ingested
+        
+        print(f"✅ Successfully ingested {ingested} agent runs!")
+        print(f"🔍 View your data at: https://docent-alpha.transluce.org/dashboard/{collection_id}")
+        return True, ingested
 
 def main():
     """Main execution"""
@@ -4,11 +4,67 @@ Script to parse agent trajectory JSON files and prepare them for Docent ingestio
 This script processes negotiation data from LLM-Deliberation experiments.
 """
 
+import csv
 import json
+import mmap
 import os
-from typing import Dict, List, Any, Optional
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Any, Iterable, Iterator, Optional
 from pathlib import Path
-import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Trajectory files larger than this are streamed with ijson (when installed)
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+def dumps_line(obj: Any) -> bytes:
+    """Serialize obj as a single NDJSON line"""
+    if orjson:
+        return orjson.dumps(obj) + b'\n'
+    return json.dumps(obj).encode('utf-8') + b'\n'
+
+def _extract_tag(text: str, open_tag: str, close_tag: str, start: int = 0) -> tuple[Optional[str], int]:
+    """Return the body of the first open_tag...close_tag pair at or after start, and the offset past it"""
+    i = text.find(open_tag, start)
+    if i < 0:
+        return None, -1
+    i += len(open_tag)
+    j = text.find(close_tag, i)
+    if j < 0:
+        return None, -1
+    return text[i:j], j + len(close_tag)
+
+def _extract_public_answer(full_answer: str, round_data: Dict[str, Any]) -> str:
+    """Return the <ANSWER> body of full_answer, falling back to the round's public_answer"""
+    answer_content, _ = _extract_tag(full_answer, '<ANSWER>', '</ANSWER>')
+    return answer_content.strip() if answer_content is not None else round_data.get('public_answer', '')
+
+def _append_round_messages(messages: List[Dict[str, str]], prompt: str, public_answer: str, full_answer: str):
+    """Append one round's Docent messages: the user prompt (if any) and the agent's answer"""
+    if prompt:
+        messages.append({'role': 'user', 'content': prompt})
+    messages.append({'role': 'assistant', 'content': public_answer or full_answer})
+
+def _make_docent_run(filename: str, messages: List[Dict[str, str]], total_rounds: int) -> Dict[str, Any]:
+    """Create a Docent run with simplified metadata"""
+    return {
+        'messages': messages,
+        'metadata': {
+            'filename': filename,
+            'experiment_type': 'multi_agent_negotiation',
+            'total_rounds': total_rounds
+        }
+    }
 
 class TrajectoryParser:
     def __init__(self, data_dir: str):
@@ -21,73 +77,133 @@ class TrajectoryParser:
         config = {}
         
         if config_path.exists():
-            with open(config_path, 'r') as f:
-                for line in f:
-                    parts = line.strip().split(',')
-                    if len(parts) >= 5:
-                        agent_name = parts[0]
-                        config[agent_name] = {
-                            'short_name': parts[1],
-                            'player_type': parts[2],
-                            'strategy': parts[3],
-                            'model': parts[4]
-                        }
+            with open(config_path, 'r', newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) < 5:
+                        continue
+                    agent_name, short_name, player_type, strategy, model = row[:5]
+                    config[agent_name] = {
+                        'short_name': short_name,
+                        'player_type': player_type,
+                        'strategy': strategy,
+                        'model': model
+                    }
         return config
     
+    @contextmanager
+    def _open_trajectory(self, filepath: str,
+                         need_header: bool = True) -> Iterator[tuple[List[Any], int, Iterable[Dict[str, Any]]]]:
+        """Open a trajectory JSON file, yielding (slot_assignment, finished_rounds, rounds).
+        With need_header=False a streamed file skips the header pass and yields ([], 0, rounds)."""
+        # Very large files are streamed round by round instead of loaded whole
+        if ijson and os.path.getsize(filepath) > STREAMING_THRESHOLD_BYTES:
+            with open(filepath, 'rb') as f:
+                slot_assignment = []
+                finished_rounds = 0
+                if need_header:
+                    # First pass: pick up the top-level scalars without building the rounds
+                    for prefix, event, value in ijson.parse(f):
+                        if prefix == 'slot_assignment.item':
+                            slot_assignment.append(value)
+                        elif prefix == 'finished_rounds':
+                            finished_rounds = value
+                    f.seek(0)
+                
+                # Yield rounds one at a time
+                yield slot_assignment, finished_rounds, ijson.items(f, 'rounds.item', use_float=True)
+            return
+        
+        with open(filepath, 'rb') as f:
+            if orjson:
+                # Decode straight from the page cache without copying the file into a bytes object
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        data = orjson.loads(view)
+            else:
+                data = json.loads(f.read())
+        
+        yield data.get('slot_assignment', []), data.get('finished_rounds', 0), data.get('rounds', [])
+    
     def parse_trajectory_file(self, filepath: str) -> Dict[str, Any]:
         """Parse a single trajectory JSON file"""
-        with open(filepath, 'r') as f:
-            data = json.load(f)
+        with self._open_trajectory(filepath) as (slot_assignment, finished_rounds, rounds):
+            return self._build_parsed_data(os.path.basename(filepath), slot_assignment, finished_rounds, rounds)
+    
+    def parse_to_docent(self, filepath: str) -> List[Dict[str, Any]]:
+        """Parse a trajectory JSON file straight into Docent runs in a single pass over its rounds"""
+        messages = []
+        total_rounds = 0
         
-        # Extract filename for metadata
-        filename = Path(filepath).name
+        with self._open_trajectory(filepath, need_header=False) as (_, _, rounds):
+            for round_data in rounds:
+                total_rounds += 1
+                
+                full_answer = round_data.get('full_answer', '') or ''
+                _append_round_messages(
+                    messages,
+                    round_data.get('prompt', ''),
+                    _extract_public_answer(full_answer, round_data),
+                    full_answer
+                )
         
+        return [_make_docent_run(os.path.basename(filepath), messages, total_rounds)]
+    
+    def _build_parsed_data(self, filename: str, slot_assignment: List[Any], finished_rounds: int,
+                           rounds: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Assemble parsed trajectory data from its top-level fields and an iterable of rounds"""
         parsed_data = {
             'filename': filename,
-            'slot_assignment': data.get('slot_assignment', []),
+            'slot_assignment': slot_assignment,
             'rounds': [],
             'metadata': {
-                'config': self.config,
-                'total_rounds': len(data.get('rounds', [])),
-                'finished_rounds': data.get('finished_rounds', 0)
+                'total_rounds': 0,
+                'finished_rounds': finished_rounds
             }
         }
         
         # Process each round
-        for round_idx, round_data in enumerate(data.get('rounds', [])):
+        for round_idx, round_data in enumerate(rounds):
             parsed_round = self._parse_round(round_data, round_idx)
             parsed_data['rounds'].append(parsed_round)
-            
+        
+        parsed_data['metadata']['total_rounds'] = len(parsed_data['rounds'])
         return parsed_data
     
     def _parse_round(self, round_data: Dict[str, Any], round_idx: int) -> Dict[str, Any]:
         """Parse a single round of negotiation"""
         agent = round_data.get('agent', '')
         
-        # Extract deal proposals using regex
-        deal_pattern = r'<DEAL>\s*([^<]+)\s*</DEAL>'
-        deals = re.findall(deal_pattern, round_data.get('full_answer', ''))
+        full_answer = round_data.get('full_answer', '') or ''
+        
+        # Extract deal proposals (bodies containing '<' are not deals, resume inside them)
+        deals = []
+        pos = 0
+        while True:
+            body, end = _extract_tag(full_answer, '<DEAL>', '</DEAL>', pos)
+            if body is None:
+                break
+            if body and '<' not in body:
+                deals.append(body.lstrip() or body[-1])
+                pos = end
+            else:
+                pos = end - len('</DEAL>') - len(body)
         
         # Extract scratchpad content
-        scratchpad_pattern = r'<SCRATCHPAD>(.*?)</SCRATCHPAD>'
-        scratchpad_match = re.search(scratchpad_pattern, round_data.get('full_answer', ''), re.DOTALL)
-        scratchpad_content = scratchpad_match.group(1).strip() if scratchpad_match else None
+        scratchpad_content, _ = _extract_tag(full_answer, '<SCRATCHPAD>', '</SCRATCHPAD>')
+        if scratchpad_content is not None:
+            scratchpad_content = scratchpad_content.strip()
         
-        # Extract public answer
-        answer_pattern = r'<ANSWER>(.*?)</ANSWER>'
-        answer_match = re.search(answer_pattern, round_data.get('full_answer', ''), re.DOTALL)
-        public_answer = answer_match.group(1).strip() if answer_match else round_data.get('public_answer', '')
+        public_answer = _extract_public_answer(full_answer, round_data)
         
         return {
             'round_index': round_idx,
             'agent': agent,
-            'agent_config': self.config.get(agent, {}),
             'prompt': round_data.get('prompt', ''),
-            'full_answer': round_data.get('full_answer', ''),
+            'full_answer': full_answer,
             'public_answer': public_answer,
             'deals_proposed': deals,
             'scratchpad_reasoning': scratchpad_content,
-            'message_length': len(round_data.get('full_answer', '')),
+            'message_length': len(full_answer),
             'has_scratchpad': scratchpad_content is not None,
             'has_deal': len(deals) > 0
         }
@@ -100,58 +216,58 @@ class TrajectoryParser:
         messages = []
         
         for round_data in parsed_data['rounds']:
-            # Add user prompt if available
-            if round_data['prompt']:
-                prompt_message = {
-                    'role': 'user',
-                    'content': round_data['prompt']
-                }
-                messages.append(prompt_message)
-            
-            # Create message for the round - simplified format
-            message = {
-                'role': 'assistant',  # Agent is responding
-                'content': round_data['public_answer'] or round_data['full_answer']
-            }
-            messages.append(message)
-        
-        # Create the run with simplified metadata
-        run = {
-            'messages': messages,
-            'metadata': {
-                'filename': parsed_data['filename'],
-                'experiment_type': 'multi_agent_negotiation',
-                'total_rounds': parsed_data['metadata']['total_rounds']
-            }
-        }
+            _append_round_messages(
+                messages,
+                round_data['prompt'],
+                round_data['public_answer'],
+                round_data['full_answer']
+            )
         
-        docent_runs.append(run)
+        docent_runs.append(_make_docent_run(
+            parsed_data['filename'],
+            messages,
+            parsed_data['metadata']['total_rounds']
+        ))
         return docent_runs
     
-    def process_all_trajectories(self) -> tuple[List[Dict[str, Any]], List[Path]]:
-        """Process all trajectory files in the data directory"""
-        all_runs = []
-        processed_files = []
-        
+    def iter_trajectories(self) -> Iterator[tuple[str, List[Dict[str, Any]]]]:
+        """Yield (file, docent runs) for each trajectory file as soon as it is processed"""
         # Find all JSON files (trajectory files)
-        json_files = list(self.data_dir.glob("history*.json"))
+        with os.scandir(self.data_dir) as entries:
+            json_files = [entry.path for entry in entries
+                          if entry.name.startswith('history') and entry.name.endswith('.json')]
         
         print(f"Found {len(json_files)} trajectory files to process...")
         
-        for json_file in json_files:
-            print(f"Processing {json_file.name}...")
-            try:
-                parsed_data = self.parse_trajectory_file(str(json_file))
-                docent_runs = self.convert_to_docent_format(parsed_data)
-                all_runs.extend(docent_runs)
-                processed_files.append(json_file)
-                print(f"Successfully processed {json_file.name} - {len(docent_runs)} runs")
-            except Exception as e:
-                print(f"Error processing {json_file.name}: {e}")
+        # Files are independent, so parse them in worker processes
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(partial(_process_one, parser=self), json_files, chunksize=4)
+            for json_file, docent_runs, error in results:
+                if error is not None:
+                    print(f"Error processing {os.path.basename(json_file)}: {error}")
+                    continue
+                print(f"Successfully processed {os.path.basename(json_file)} - {len(docent_runs)} runs")
+                yield json_file, docent_runs
+    
+    def process_all_trajectories(self) -> tuple[List[Dict[str, Any]], List[str]]:
+        """Process all trajectory files in the data directory"""
+        all_runs = []
+        processed_files = []
+        
+        for json_file, docent_runs in self.iter_trajectories():
+            all_runs.extend(docent_runs)
+            processed_files.append(json_file)
         
         print(f"Total runs prepared for Docent: {len(all_runs)}")
         return all_runs, processed_files
 
+def _process_one(json_file: str, parser: TrajectoryParser) -> tuple[str, List[Dict[str, Any]], Optional[str]]:
+    """Parse and convert one trajectory file in a worker process"""
+    try:
+        return json_file, parser.parse_to_docent(json_file), None
+    except Exception as e:
+        return json_file, [], str(e)
+
 def main():
     """Main execution function"""
     data_dir = "/scratch/gpfs/DANQIC/jz4391/LLM-Deliberation/games_descriptions/base/output/base_test_small"
@@ -159,38 +275,52 @@ def main():
     # Initialize parser
     parser = TrajectoryParser(data_dir)
     
-    # Process all trajectory files
-    docent_runs, processed_files = parser.process_all_trajectories()
+    # Processed files are moved here to prevent re-processing
+    processed_dir = Path(data_dir) / "processed"
+    processed_dir.mkdir(exist_ok=True)
     
-    # Save processed data for inspection
-    output_file = Path(__file__).parent / "docent_prepared_data.json"
-    with open(output_file, 'w') as f:
-        json.dump(docent_runs, f, indent=2)
+    # Stream processed runs to NDJSON (one run per line) as each file finishes
+    output_file = Path(__file__).parent / "docent_prepared_data.jsonl"
+    moved_count = 0
+    run_count = 0
+    total_messages = 0
+    agents = set()
     
-    print(f"Processed data saved to {output_file}")
-    print(f"Ready for Docent ingestion: {len(docent_runs)} runs")
+    with open(output_file, 'wb') as f:
+        for json_file, docent_runs in parser.iter_trajectories():
+            for run in docent_runs:
+                f.write(dumps_line(run))
+                run_count += 1
+                total_messages += len(run['messages'])
+                for msg in run['messages']:
+                    if 'agent_name' in msg.get('metadata', {}):
+                        agents.add(msg['metadata']['agent_name'])
+            
+            # Move the file only once its runs are in the output, so a failure never loses a trajectory
+            f.flush()
+            try:
+                os.replace(json_file, processed_dir / os.path.basename(json_file))
+                moved_count += 1
+            except OSError as e:
+                print(f"Could not move {os.path.basename(json_file)} to processed/: {e}")
+    
+    # The agent config is shared by every run, so it is saved once alongside the runs
+    config_file = Path(__file__).parent / "docent_prepared_config.json"
+    if orjson:
+        with open(config_file, 'wb') as f:
+            f.write(orjson.dumps(parser.config, option=orjson.OPT_INDENT_2))
+    else:
+        with open(config_file, 'w') as f:
+            json.dump(parser.config, f, indent=2)
     
-    # Move processed files to prevent re-processing
-    if processed_files:
-        processed_dir = Path(data_dir) / "processed"
-        processed_dir.mkdir(exist_ok=True)
-        print(f"\nMoving {len(processed_files)} processed files to {processed_dir}...")
-        
-        for json_file in processed_files:
-            destination = processed_dir / json_file.name
-            json_file.rename(destination)
-            print(f"Moved {json_file.name} to processed/")
+    print(f"Processed data saved to {output_file}")
+    print(f"Agent config saved to {config_file}")
+    print(f"Ready for Docent ingestion: {run_count} runs")
+    print(f"Moved {moved_count} processed files to {processed_dir}")
     
     # Print summary statistics
     print("\n=== Summary Statistics ===")
-    total_messages = sum(len(run['messages']) for run in docent_runs)
     print(f"Total messages: {total_messages}")
-    
-    agents = set()
-    for run in docent_runs:
-        for msg in run['messages']:
-            if 'agent_name' in msg.get('metadata', {}):
-                agents.add(msg['metadata']['agent_name'])
     print(f"Unique agents: {len(agents)} - {list(agents)}")
 
 if __name__ == "__main__":
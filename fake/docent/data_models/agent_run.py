@@ -0,0 +1,2 @@
+class AgentRun:
+    def __init__(self, **kw): self.__dict__.update(kw)
@@ -0,0 +1,3 @@
+class UserMessage:
+    def __init__(self, **kw): self.__dict__.update(kw)
+class AssistantMessage(UserMessage): pass
@@ -0,0 +1,3 @@
+class BaseAgentRunMetadata:
+    def __init__(self, **kw): self.__dict__.update(kw)
+class BaseMetadata(BaseAgentRunMetadata): pass